@@ -1,20 +1,87 @@
 import streamlit as st
 import pandas as pd
 import google.generativeai as genai
-from datetime import datetime
-import json
+from google.api_core import exceptions as google_exceptions
+from datetime import datetime, timedelta
+import orjson
 import gspread
-import pytz 
+from zoneinfo import ZoneInfo
 import time
 from gtts import gTTS 
 import io
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from tenacity import (
+    retry, retry_if_exception, retry_if_exception_type,
+    stop_after_attempt, wait_exponential, wait_random_exponential
+)
 
 # --- 1. 配置你的 AI ---
-try:
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+
+# 结构化输出：Gemini 直接返回符合该结构的 JSON，无需再清理代码块标记
+STRUCTURE_ITEM_FIELDS = ["word", "reading", "pos_meaning", "grammar", "standard"]
+ANALYSIS_FIELDS = ["language", "original_input", "target_sentence", "correction", "translation", "nuances"]
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **{field: {"type": "STRING"} for field in ANALYSIS_FIELDS},
+        "structure": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {field: {"type": "STRING"} for field in STRUCTURE_ITEM_FIELDS},
+                "required": STRUCTURE_ITEM_FIELDS,
+            },
+        },
+    },
+    "required": ANALYSIS_FIELDS + ["structure"],
+}
+
+# 固定的任务说明作为 system_instruction 随模型创建一次，每次请求只发送目标语言和输入文本
+SYSTEM_INSTRUCTION = """
+    请作为一位精通全球语言的语言学专家，对用户给出的文本执行两步操作：
+    1. **翻译：** 将用户输入的文本翻译成用户指定的 **目标语言**。
+    2. **解析：** 对 **翻译后的目标语言句子** 进行全面的语法、结构和语境分析。
+
+    请严格执行以下要求，对**翻译后的目标语言句子**进行分析：
+    - **检查和润色：** 检查翻译后的句子是否有语法错误、表达不自然或不地道的地方。如果需要修正，请提供一个地道的版本。如果原文完美，请返回原文。
+    - **翻译：** 提供**翻译后的句子**的**中文（简体）**翻译。
+    - **逐词拆解：** 对**翻译后的句子**进行逐词/逐结构拆解分析。
+
+    请输出一个严格的 JSON 格式对象，包含以下七个字段：
+    1. "language": 目标解析语言的名称 (字符串，即用户指定的目标语言)。
+    2. "original_input": 用户输入的原始文本。
+    3. "target_sentence": AI 将原始文本翻译成目标语言后的句子。
+    4. "correction": **修正/润色后的目标语言版本** (如果目标句子无错，则返回目标句子)。
+    5. "translation": 翻译后的句子对应的中文翻译。
+    6. "nuances": 详细的语法笔记、惯用语解释或文化背景说明。
+    7. "structure": 一个列表，包含逐词拆解，每个元素包含：
+       - "word": 原文单词/词组
+       - "reading": 发音注音 (请根据目标语言提供合适的注音)
+       - "pos_meaning": 词性及中文含义
+       - "grammar": 简短语法说明 (时态、变位等)
+       - "standard": 原型/标准形式 (如动词原形)
+    """
+
+def build_model():
+    return genai.GenerativeModel(
+        GEMINI_MODEL_NAME,
+        system_instruction=SYSTEM_INSTRUCTION,
+        generation_config={"response_mime_type": "application/json", "response_schema": ANALYSIS_SCHEMA}
+    )
+
+# 模型句柄只在首次调用时创建，之后每次重跑直接复用
+@st.cache_resource
+def get_model():
     # 假设 GOOGLE_API_KEY 已配置
-    GOOGLE_API_KEY = st.secrets["GOOGLE_API_KEY"]
-    genai.configure(api_key=GOOGLE_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+    return build_model()
+
+try:
+    get_model()
 except KeyError:
     st.error("无法读取 Gemini API Key。请在 Streamlit Cloud Secrets 中检查 GOOGLE_API_KEY 配置。")
 except Exception as e:
@@ -28,17 +95,21 @@ except Exception as e:
 SHEET_TITLE = "Japanese_Grammar_History"
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1xrXmiV5yEYIC4lDfgjk79vQDNVHYZugW6XUReZbHWjY/edit?gid=0#gid=0" 
 
-@st.cache_resource(ttl=3600)
+# 凭证只解析一次，客户端过期重建时不再重复解析 JSON 字符串
+@st.cache_resource
+def load_gcp_credentials():
+    if "GCP_JSON_STRING" in st.secrets:
+        return orjson.loads(st.secrets["GCP_JSON_STRING"])
+    elif "gcp_service_account" in st.secrets:
+        return dict(st.secrets["gcp_service_account"])
+    return None
+
+@st.cache_resource(ttl=3600, show_spinner=False)
 def get_sheets_client():
     try:
-        if "GCP_JSON_STRING" in st.secrets:
-            key_dict = json.loads(st.secrets["GCP_JSON_STRING"])
-            gc = gspread.service_account_from_dict(key_dict)
-            return gc
-        elif "gcp_service_account" in st.secrets:
-            gcp_sa = st.secrets["gcp_service_account"]
-            gc = gspread.service_account_from_dict(gcp_sa)
-            return gc
+        key_dict = load_gcp_credentials()
+        if key_dict:
+            return gspread.service_account_from_dict(key_dict)
         else:
             st.warning("未找到 Google Cloud 凭证 (GCP_JSON_STRING)。")
             return None
@@ -46,58 +117,247 @@ def get_sheets_client():
         st.error(f"Google Sheets 认证失败: {e}")
         return None
 
-# 缓存数据读取
-@st.cache_data(ttl=60) 
-def load_history():
-    """从 Google Sheets 读取历史记录"""
+def is_quota_error(e):
+    """Google Sheets 返回 429（超出配额）时才值得重试"""
+    return isinstance(e, gspread.exceptions.APIError) and e.response.status_code == 429
+
+@retry(
+    retry=retry_if_exception(is_quota_error),
+    wait=wait_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+def sheets_call(func, *args, **kwargs):
+    """执行一次 Google Sheets API 调用，遇到 429 时指数退避重试，其它错误直接抛出"""
+    return func(*args, **kwargs)
+
+# 缓存已打开的工作表句柄，避免每次读写都请求一次 open_by_url 元数据
+@st.cache_resource(ttl=3600, show_spinner=False)
+def get_worksheet():
+    return sheets_call(get_sheets_client().open_by_url, SHEET_URL).sheet1
+
+# 仅供程序内部查找/搜索使用的派生列，导出时去掉
+INTERNAL_COLUMNS = ['sentence_key', 'search_blob']
+
+def build_history_frame(header, rows):
+    """将表格原始行构建为历史记录 DataFrame，并解析 data_json"""
+    # 行尾空单元格不会返回，补齐到表头长度
+    df = pd.DataFrame([row + [''] * (len(header) - len(row)) for row in rows], columns=header)
+    
+    if 'data_json' in df.columns:
+        # 列表推导直接遍历底层数组，避免 Series.apply 的逐行调度开销
+        parsed = [orjson.loads(x) if x else {} for x in df['data_json'].to_numpy()]
+        df['data'] = parsed
+        # 兼容性处理：语言现在从 data.language 中读取
+        df['language'] = [x.get('language', '未知') if isinstance(x, dict) else '未知' for x in parsed]
+    if 'sentence' in df.columns:
+        df['sentence_key'] = [normalize_sentence(s) for s in df['sentence'].astype(str)]
+        # 搜索用的小写拼接列：原文 + 完整解析 JSON，加载时只构建一次
+        data_json = df['data_json'] if 'data_json' in df.columns else ''
+        df['search_blob'] = (df['sentence'].astype(str) + '\x1f' + data_json).str.lower()
+    return df
+
+HISTORY_FULL_RELOAD_SECONDS = 600 # 快照超过该时长后全量重新读取，纠正表格在其他地方被删除/排序/修改造成的偏差
+HISTORY_FAILURE_COOLDOWN_SECONDS = 60 # 读取失败后在该时长内直接使用已有快照，不再请求 Google Sheets
+
+# 进程内保存已读取的历史记录；缓存过期后只从表格读取新增的行
+@st.cache_resource
+def get_history_snapshot():
+    return {"lock": threading.Lock(), "header": None, "df": None, "loaded_at": 0.0, "failed_at": None}
+
+def reset_history_snapshot():
+    """丢弃已读取的快照，下次加载时全量读取（删除记录或手动同步时使用）"""
+    snapshot = get_history_snapshot()
+    with snapshot["lock"]:
+        snapshot["header"] = None
+        snapshot["df"] = None
+        snapshot["failed_at"] = None # 手动同步时立即重试，不等待冷却
+    fetch_history.clear()
+
+# 缓存数据读取（写入成功后由 save_record / 删除回调主动失效）
+# 用 cache_resource 返回同一个 DataFrame 对象：每次重跑的多处调用都不再反序列化整份历史副本，
+# 调用方只做筛选等只读操作，不修改返回的 DataFrame
+# 读取失败时直接抛出异常，失败结果不会被缓存，由 load_history 统一处理
+@st.cache_resource(ttl=300, show_spinner=False)
+def fetch_history():
+    """从 Google Sheets 读取历史记录（首次全量，之后增量）"""
     gc = get_sheets_client()
     if not gc: return pd.DataFrame()
     
-    try:
-        spreadsheet = gc.open_by_url(SHEET_URL)
-        worksheet = spreadsheet.sheet1
-        df = pd.DataFrame(worksheet.get_all_records())
+    worksheet = get_worksheet()
+    spreadsheet = worksheet.spreadsheet
+    snapshot = get_history_snapshot()
+    with snapshot["lock"]:
+        # 增量读取假设表格只会追加；定期全量读取，保证外部删除的影响不超过 HISTORY_FULL_RELOAD_SECONDS
+        snapshot_expired = time.monotonic() - snapshot["loaded_at"] > HISTORY_FULL_RELOAD_SECONDS
+        if snapshot["df"] is None or snapshot_expired:
+            # 直接读取原始二维值，跳过 get_all_records 的逐行 dict 构造
+            values = sheets_call(spreadsheet.values_get, gspread.utils.absolute_range_name(worksheet.title, "A:D")).get('values', [])
+            if not values: return pd.DataFrame()
+            snapshot["header"] = values[0]
+            snapshot["df"] = build_history_frame(values[0], values[1:])
+            snapshot["loaded_at"] = time.monotonic()
+        else:
+            # 第 1 行是表头，只读取快照之后新增的行
+            start_row = len(snapshot["df"]) + 2
+            new_rows = sheets_call(spreadsheet.values_get, gspread.utils.absolute_range_name(worksheet.title, f"A{start_row}:D")).get('values', [])
+            if new_rows:
+                new_df = build_history_frame(snapshot["header"], new_rows)
+                snapshot["df"] = pd.concat([snapshot["df"], new_df], ignore_index=True)
         
-        if 'data_json' in df.columns:
-            df['data'] = df['data_json'].apply(lambda x: json.loads(x) if x else {})
-            # 兼容性处理：语言现在从 data.language 中读取
-            df['language'] = df['data'].apply(lambda x: x.get('language', '未知') if isinstance(x, dict) else '未知')
-            
-        return df.iloc[::-1] # 倒序
-    except gspread.exceptions.SpreadsheetNotFound:
-        st.warning(f"Google 表格 '{SHEET_TITLE}' 不存在或无访问权限。")
-        return pd.DataFrame()
-    except Exception as e:
-        st.error(f"加载历史记录失败: {e}") 
-        return pd.DataFrame()
+        return snapshot["df"] # 保持表格原始顺序，展示时再倒序遍历
+
+def load_history():
+    """读取历史记录；读取失败时提示错误并沿用内存中已有的快照"""
+    snapshot = get_history_snapshot()
+    failed_at = snapshot["failed_at"]
+    # 刚失败过（例如 429 配额超限）时先冷却一段时间：同一次重跑中的多处调用
+    # 不会各自再经历一轮退避重试，也不会重复弹出错误提示
+    if failed_at is None or time.monotonic() - failed_at > HISTORY_FAILURE_COOLDOWN_SECONDS:
+        try:
+            history_df = fetch_history()
+            snapshot["failed_at"] = None
+            return history_df
+        except gspread.exceptions.SpreadsheetNotFound:
+            st.warning(f"Google 表格 '{SHEET_TITLE}' 不存在或无访问权限。")
+        except Exception as e:
+            st.error(f"加载历史记录失败: {e}") 
+        snapshot["failed_at"] = time.monotonic()
+    # 一次临时错误不应让历史、统计、复用和删除全部消失
+    snapshot_df = snapshot["df"]
+    return snapshot_df if snapshot_df is not None else pd.DataFrame()
+
+
+# 只去掉不改变句意的句号；问号、感叹号等决定句子类型的标点需保留，
+# 否则 "It's raining?" 会复用 "It's raining." 的解析结果
+SENTENCE_END_PUNCTUATION = "。．."
 
+def normalize_sentence(text):
+    """归一化句子用于重复判断：忽略大小写、多余空白和句末的单个句号"""
+    text = " ".join(text.split()).casefold()
+    # 只去掉一个句号；"..."、"。。" 这类连续标点表示省略/拖长语气，需保留
+    terminators = tuple(SENTENCE_END_PUNCTUATION)
+    if text.endswith(terminators) and not text[:-1].endswith(terminators):
+        text = text[:-1].rstrip()
+    return text
+
+def find_history_analysis(history_df, input_text, target_language):
+    """在历史记录中查找相同句子、相同目标语言、相同提示词版本的解析结果，命中则无需再次调用 Gemini"""
+    if history_df.empty or 'sentence_key' not in history_df.columns or 'data' not in history_df.columns:
+        return None
+    
+    matches = history_df[
+        (history_df['sentence_key'] == normalize_sentence(input_text)) &
+        (history_df['language'] == target_language)
+    ]
+    # 优先复用最新的一条；修改提示词或输出结构之前保存的结果不再复用
+    for data in reversed(matches['data'].tolist()):
+        if isinstance(data, dict) and "structure" in data and data.get("analysis_version") == ANALYSIS_VERSION:
+            return data
+    return None
+
+
+SHEET_HEADER = ['timestamp', 'sentence', 'data_json', 'user']
+TZ_SH = ZoneInfo('Asia/Shanghai') # 记录时间戳使用的时区
+
+# 表头状态在整个进程中共享，只在首次保存时请求一次 row_values(1)
+@st.cache_resource
+def get_header_state():
+    return {"lock": threading.Lock(), "checked": False}
+
+def with_sheet_header(rows):
+    """表格为空时把表头并入同一批写入的行，表头和数据只需一次 values.append"""
+    header_state = get_header_state()
+    with header_state["lock"]:
+        if not header_state["checked"]:
+            if not sheets_call(get_worksheet().row_values, 1):
+                rows = [SHEET_HEADER] + rows
+            header_state["checked"] = True
+    return rows
 
 def save_record(sentence, result_data):
-    """将新的记录写入 Google Sheets"""
+    """将新的记录加入待写入队列，由 flush_pending_rows 批量写入 Google Sheets"""
+    record_time = datetime.now(TZ_SH).replace(microsecond=0)
+    # 时间戳是删除和勾选框的主键；批量模式同一秒内保存多条时依次顺延一秒保证唯一
+    last_time = st.session_state.get('last_record_time')
+    if last_time and record_time <= last_time:
+        record_time = last_time + timedelta(seconds=1)
+    st.session_state['last_record_time'] = record_time
+    timestamp_str = record_time.strftime("%Y-%m-%d %H:%M:%S")
+
+    new_row = [
+        timestamp_str,
+        sentence, # 存储原始输入
+        # 记录生成时的提示词/结构版本，版本变化后 find_history_analysis 不再复用这条结果
+        orjson.dumps({**result_data, "analysis_version": ANALYSIS_VERSION}).decode(), # orjson 默认输出 UTF-8，不转义中文
+        st.session_state.get('user_id', 'Unknown')
+    ]
+    st.session_state.setdefault('pending_rows', []).append(new_row)
+
+
+# 后台写入线程池，所有会话共享
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+def append_rows_to_sheet(worksheet, rows):
+    """在后台线程中执行写入（不访问 session_state），完成后让历史缓存失效"""
+    sheets_call(
+        worksheet.spreadsheet.values_append,
+        gspread.utils.absolute_range_name(worksheet.title, "A1"),
+        {"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"},
+        {"values": rows}
+    )
+    fetch_history.clear()
+
+SAVE_MAX_ATTEMPTS = 3 # 后台写入失败后自动重新提交的总次数上限，超过后留在队列中等待手动重试
+
+def submit_save_job(worksheet, rows, attempt=1):
+    """提交一次后台写入，并记录第几次尝试"""
+    future = get_executor().submit(append_rows_to_sheet, worksheet, rows)
+    st.session_state['save_jobs'] = st.session_state.get('save_jobs', []) + [(future, rows, attempt)]
+
+def flush_pending_rows():
+    """将积攒的记录提交到后台线程，用一次 values.append 请求写入 Google Sheets"""
+    pending_rows = st.session_state.get('pending_rows')
+    if not pending_rows: return
+    
     gc = get_sheets_client()
     if not gc: return
     
     try:
-        spreadsheet = gc.open_by_url(SHEET_URL)
-        worksheet = spreadsheet.sheet1
-        
-        tz = pytz.timezone('Asia/Shanghai')
-        timestamp_str = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-
-        new_row = [
-            timestamp_str,
-            sentence, # 存储原始输入
-            json.dumps(result_data, ensure_ascii=False), 
-            st.session_state.get('user_id', 'Unknown')
-        ]
+        worksheet = get_worksheet()
+        rows = with_sheet_header(pending_rows)
         
-        if not worksheet.row_values(1):
-            worksheet.append_row(['timestamp', 'sentence', 'data_json', 'user'])
-
-        worksheet.append_row(new_row)
+        submit_save_job(worksheet, rows)
+        st.session_state['pending_rows'] = []
     except Exception as e:
+        # 写入失败时保留队列，下次保存时一并重试
         st.error(f"保存记录到 Google Sheets 失败: {e}")
 
+def check_save_jobs():
+    """检查后台写入结果：失败的任务自动重新提交（最多 SAVE_MAX_ATTEMPTS 次），
+    仍失败的记录放回队列等待手动重试；返回仍在保存中的记录条数"""
+    jobs = st.session_state.get('save_jobs', [])
+    st.session_state['save_jobs'] = []
+    for future, rows, attempt in jobs:
+        if not future.done():
+            st.session_state['save_jobs'].append((future, rows, attempt))
+        elif future.exception():
+            if attempt < SAVE_MAX_ATTEMPTS:
+                try:
+                    submit_save_job(get_worksheet(), rows, attempt + 1)
+                    continue
+                except Exception:
+                    pass
+            st.error(f"保存记录到 Google Sheets 失败（已尝试 {attempt} 次）: {future.exception()}")
+            st.session_state['pending_rows'] = rows + st.session_state.get('pending_rows', [])
+    return sum(count_record_rows(rows) for _, rows, _ in st.session_state['save_jobs'])
+
+def count_record_rows(rows):
+    """待写入的行中可能带着表头，统计时只计算记录行"""
+    return sum(1 for row in rows if row != SHEET_HEADER)
+
 
 def delete_records_by_bulk(timestamps_list):
     """根据时间戳列表批量删除 Google Sheets 中的记录"""
@@ -105,34 +365,69 @@ def delete_records_by_bulk(timestamps_list):
     if not gc or not timestamps_list: return False
     
     try:
-        spreadsheet = gc.open_by_url(SHEET_URL)
-        worksheet = spreadsheet.sheet1
-        
-        timestamps_col = worksheet.col_values(1)
+        worksheet = get_worksheet()
+        spreadsheet = worksheet.spreadsheet
         
-        rows_to_delete = []
-        for ts in timestamps_list:
-            try:
-                row_index = timestamps_col.index(ts) + 1
-                rows_to_delete.append(row_index)
-            except ValueError:
-                continue
+        # 复用已缓存的历史记录定位行号，不再单独请求 col_values(1)
+        # 历史记录保持表格原始顺序：第 idx 条数据位于第 idx + 2 行（第 1 行为表头）
+        history_df = load_history()
+        if 'timestamp' not in history_df.columns: return False
+        ts_to_row = {ts: idx + 2 for idx, ts in enumerate(history_df['timestamp'])}
+        targets = [(ts_to_row[ts], ts) for ts in timestamps_list if ts in ts_to_row]
         
-        if not rows_to_delete:
+        if not targets:
             st.toast("⚠️ 未找到要删除的记录。", icon="⚠️")
             return False
 
+        # 快照中的行号可能已过期（表格被手动排序/编辑，或在其他进程中删除过行），
+        # 删除前用一次 batchGet 核对这些行 A 列的时间戳，不一致则放弃删除并全量重新读取
+        value_ranges = sheets_call(
+            spreadsheet.values_batch_get,
+            [gspread.utils.absolute_range_name(worksheet.title, f"A{row_idx}") for row_idx, _ in targets]
+        ).get('valueRanges', [])
+        sheet_ts = [(value_range.get('values') or [['']])[0][0] for value_range in value_ranges]
+        if sheet_ts != [ts for _, ts in targets]:
+            reset_history_snapshot()
+            st.error("表格内容已在其他地方发生变化，为避免误删已取消本次删除。记录已重新同步，请确认后再试。")
+            return False
+
+        rows_to_delete = [row_idx for row_idx, _ in targets]
+
+        # 从下往上删除，保证同一批请求中前面的删除不会改变后续行号
         rows_to_delete.sort(reverse=True)
-        
-        success_count = 0
+        # 相邻的行合并为一个 [起始行, 结束行] 区间，一个区间只需一条 deleteDimension
+        row_ranges = []
         for row_idx in rows_to_delete:
-            worksheet.delete_rows(row_idx)
-            success_count += 1
+            if row_ranges and row_ranges[-1][0] == row_idx + 1:
+                row_ranges[-1][0] = row_idx
+            else:
+                row_ranges.append([row_idx, row_idx])
+        
+        # 所有删除合并为一次 batchUpdate 请求
+        sheets_call(spreadsheet.batch_update, {
+            "requests": [
+                {
+                    "deleteDimension": {
+                        "range": {
+                            "sheetId": worksheet.id,
+                            "dimension": "ROWS",
+                            "startIndex": start_row - 1,
+                            "endIndex": end_row
+                        }
+                    }
+                }
+                for start_row, end_row in row_ranges
+            ]
+        })
+        success_count = len(rows_to_delete)
         
+        # 删除会使后续行号整体前移，增量快照失效，需全量重新读取
+        reset_history_snapshot()
         st.toast(f"✅ 成功删除 {success_count} 条记录！", icon="🗑️")
         return True
             
     except Exception as e:
+        reset_history_snapshot()
         st.error(f"批量删除失败: {e}")
         return False
 
@@ -146,36 +441,65 @@ COLUMN_MAPPING = {
 }
 
 
+def render_structure_table(structure):
+    """用 st.table 展示逐词拆解（单元格自动换行，移动端能看全长的词性/语法说明），无数据时返回 False"""
+    df = pd.DataFrame(structure)
+    if df.empty:
+        return False
+    st.table(df.rename(columns=COLUMN_MAPPING))
+    return True
+
+
 # --- 辅助函数：状态同步 ---
 
+def filter_by_search(df, search_query):
+    """多关键词搜索：按空白拆分，每个关键词都出现在 search_blob 中才算命中"""
+    # 逐个关键词缩小范围，后面的关键词只扫描已命中的行
+    for term in search_query.lower().split():
+        df = df[df['search_blob'].str.contains(term, regex=False, na=False)]
+    return df
+
 def update_individual_selection(ts):
-    checkbox_key = f"sel_{ts}"
-    is_checked = st.session_state[checkbox_key] 
-    st.session_state.delete_selections[ts] = is_checked
-    if not is_checked and st.session_state.select_all:
-        st.session_state.select_all = False
+    is_checked = st.session_state[f"sel_{ts}"]
+    # delete_selections 只保存已勾选的时间戳，取消勾选时直接移除，避免长时间浏览后不断增长
+    if is_checked:
+        st.session_state.delete_selections[ts] = True
+    else:
+        st.session_state.delete_selections.pop(ts, None)
+        if st.session_state.select_all:
+            st.session_state.select_all = False
+
+def filter_history(history_df, filter_language, filter_date, search_query):
+    """按语言、日期、关键词依次筛选历史记录（每次重跑只计算一次）"""
+    filtered_df = history_df
+    if filter_language:
+        # 用 numpy 布尔数组筛选，跳过 Series 比较结果的索引对齐
+        filtered_df = filtered_df[filtered_df['language'].to_numpy() == filter_language]
+    if filter_date:
+        filtered_df = filtered_df[pd.to_datetime(filtered_df['timestamp']).dt.date == filter_date]
+    if search_query:
+        filtered_df = filter_by_search(filtered_df, search_query)
+    return filtered_df
 
 def update_selections():
     select_all_state = st.session_state.select_all
     
-    history_df = load_history() 
-    
-    filter_lang = st.session_state.get('filter_language', None)
-    search_query = st.session_state.get('search_query', '')
-    
-    filtered_df = history_df.copy()
-    if filter_lang:
-        filtered_df = filtered_df[filtered_df['language'] == filter_lang]
-    if search_query:
-        filtered_df = filtered_df[
-            filtered_df['sentence'].str.contains(search_query, case=False, na=False) | 
-            (filtered_df['data'].astype(str).str.contains(search_query, case=False, na=False))
-        ]
-        
-    for ts in filtered_df['timestamp']:
-        st.session_state.delete_selections[ts] = select_all_state
-        if f"sel_{ts}" in st.session_state:
-            st.session_state[f"sel_{ts}"] = select_all_state
+    # 直接使用上次渲染的当前页时间戳，无需重新加载和筛选历史记录；
+    # 全选只作用于已显示的记录，不会选中用户没看到的后续页
+    filtered_ts = st.session_state.get('_page_ts', [])
+    # delete_selections 是普通 dict，用一次 dict.update 批量写入，不逐条经过 session_state 代理；
+    # 取消全选时移除对应条目，字典中只保留已勾选的记录
+    selections = st.session_state.delete_selections
+    if select_all_state:
+        selections.update(dict.fromkeys(filtered_ts, True))
+    else:
+        for ts in filtered_ts:
+            selections.pop(ts, None)
+    # 只有已渲染过的勾选框才有对应的 widget 状态需要同步
+    for ts in filtered_ts:
+        checkbox_key = f"sel_{ts}"
+        if checkbox_key in st.session_state:
+            st.session_state[checkbox_key] = select_all_state
 
 def bulk_delete_callback(timestamps_to_delete):
     if not timestamps_to_delete:
@@ -185,84 +509,211 @@ def bulk_delete_callback(timestamps_to_delete):
     if delete_records_by_bulk(timestamps_to_delete):
         st.session_state.select_all = False
         st.session_state.delete_selections = {}
-        time.sleep(1) 
-        load_history.clear()
+        # 已删除记录的勾选框和复习模式状态不会再渲染，清理掉避免 session_state 持续膨胀
+        for ts in timestamps_to_delete:
+            st.session_state.pop(f"sel_{ts}", None)
+            st.session_state.pop(f"reveal_{ts}", None)
+        # delete_records_by_bulk 已重置历史快照和缓存，成功提示由 toast 保留到重跑之后，无需等待
+
+TTS_MAX_CHARS = 1000 # 朗读文本长度上限，避免超长输入生成数 MB 的音频并长时间阻塞页面
+TTS_LANG_CODES = {
+    '英语': 'en', '日语': 'ja', '中文': 'zh-cn', '法语': 'fr', 
+    '韩语': 'ko', '西班牙语': 'es', '德语': 'de', '俄语': 'ru', '意大利语': 'it'
+}
+
+# 同一句子重复朗读时直接返回缓存的音频；出错时抛出异常，失败结果不会被缓存
+@st.cache_data(ttl=7 * 24 * 3600, max_entries=200, show_spinner=False)
+def synthesize_speech(text, lang_code):
+    fp = io.BytesIO()
+    gTTS(text=text, lang=lang_code).write_to_fp(fp)
+    return fp.getvalue()
 
 def text_to_speech(text, lang_name):
-    """使用 gTTS 生成语音，返回音频字节流"""
-    lang_map = {
-        '英语': 'en', '日语': 'ja', '中文': 'zh-cn', '法语': 'fr', 
-        '韩语': 'ko', '西班牙语': 'es', '德语': 'de', '俄语': 'ru', '意大利语': 'it'
-    }
-    lang_code = lang_map.get(lang_name, 'en') 
-    
+    """使用 gTTS 生成语音，返回 MP3 字节（失败时返回 None）"""
     try:
-        tts = gTTS(text=text, lang=lang_code)
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        return fp
-    except Exception as e:
-        # print(f"TTS Error: {e}") # Debugging
+        return synthesize_speech(text[:TTS_MAX_CHARS], TTS_LANG_CODES.get(lang_name, 'en'))
+    except Exception:
         return None
+
+# 朗读预生成线程池，与保存记录的线程池分开，预生成不会拖慢云端保存
+@st.cache_resource
+def get_tts_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+def prewarm_speech(items):
+    """后台为当前页的历史记录预生成朗读音频，点击「朗读」时直接命中 synthesize_speech 缓存"""
+    previous = st.session_state.get('tts_prewarmed', set())
+    executor = get_tts_executor()
+    page_keys = set()
+    for item in items:
+        data = item.get('data')
+        # 解析失败的记录不显示「朗读」按钮，无需预生成
+        if not isinstance(data, dict) or "structure" not in data:
+            continue
+        key = (data.get('target_sentence', item['sentence']), item.get('language', '未知'))
+        page_keys.add(key)
+        # 上次渲染已提交过的句子不再重复排队
+        if key not in previous:
+            executor.submit(text_to_speech, *key)
+    # 只记住当前页的句子，集合大小不超过一页，不会随浏览不断增长
+    st.session_state['tts_prewarmed'] = page_keys
     
 # 🌟 修改后的回调函数：清除日期筛选
 def clear_date_filter():
     """将 Session State 中的日期筛选值设置为 None 并强制刷新"""
     st.session_state.filter_date = None
+    reset_history_page()
     # 强制重新运行以确保筛选被清除
     st.rerun()
 
-# --- 4. 核心功能：AI 分析 (支持目标语言) ---
-def analyze_with_ai(input_text, target_language):
-    
-    prompt = f"""
-    请作为一位精通全球语言的语言学专家，对以下文本执行两步操作：
-    1. **翻译：** 将用户输入的文本翻译成 **{target_language}**。
-    2. **解析：** 对 **翻译后的 {target_language} 句子** 进行全面的语法、结构和语境分析。
+# 导出的 CSV 只在历史记录变化（条数、最新时间戳或全量重新读取的时间改变）时重新生成，平时重跑直接复用；
+# 全量读取会带入在其他地方修改过的行，因此 loaded_at 也作为缓存键的一部分
+# _history_df 以下划线开头不参与哈希，避免每次重跑都哈希整份历史
+@st.cache_data(max_entries=4, show_spinner=False)
+def build_history_csv(_history_df, row_count, last_timestamp, loaded_at):
+    export_df = _history_df.drop(columns=INTERNAL_COLUMNS, errors='ignore')
+    return export_df[::-1].to_csv(index=False).encode('utf-8-sig') # 最新记录在前
 
-    用户输入的文本是：“{input_text}”
+HISTORY_PAGE_SIZE = 10 # 学习足迹每页显示的记录数
 
-    请严格执行以下要求，对**翻译后的 {target_language} 句子**进行分析：
-    - **检查和润色：** 检查翻译后的句子是否有语法错误、表达不自然或不地道的地方。如果需要修正，请提供一个地道的版本。如果原文完美，请返回原文。
-    - **翻译：** 提供**翻译后的句子**的**中文（简体）**翻译。
-    - **逐词拆解：** 对**翻译后的句子**进行逐词/逐结构拆解分析。
+def load_more_history():
+    st.session_state.history_page += 1
 
-    请输出一个严格的 JSON 格式对象，包含以下七个字段：
-    1. "language": 目标解析语言的名称 (字符串，即 "{target_language}")。
-    2. "original_input": 用户输入的原始文本。
-    3. "target_sentence": AI 将原始文本翻译成 {target_language} 后的句子。
-    4. "correction": **修正/润色后的 {target_language} 版本** (如果目标句子无错，则返回目标句子)。
-    5. "translation": 翻译后的句子对应的中文翻译。
-    6. "nuances": 详细的语法笔记、惯用语解释或文化背景说明。
-    7. "structure": 一个列表，包含逐词拆解，每个元素包含：
-       - "word": 原文单词/词组
-       - "reading": 发音注音 (请根据 {target_language} 提供合适的注音)
-       - "pos_meaning": 词性及中文含义
-       - "grammar": 简短语法说明 (时态、变位等)
-       - "standard": 原型/标准形式 (如动词原形)
+def reset_history_page():
+    """筛选条件（关键词、日期、语言）变化时回到第一页，并取消全选"""
+    st.session_state.history_page = 1
+    st.session_state.select_all = False
 
-    请确保输出是合法的 JSON 格式。
-    """
+# --- 4. 核心功能：AI 分析 (支持目标语言) ---
+BATCH_CONCURRENCY = 8 # 批量模式下同时进行的 Gemini 请求上限，避免超出 QPM 配额
+
+# 每次请求只发送目标语言和输入文本，固定的任务说明见 SYSTEM_INSTRUCTION
+PROMPT_TEMPLATE = "目标语言：{target_language}\n用户输入的文本是：“{input_text}”"
+
+def build_prompt(input_text, target_language):
+    return PROMPT_TEMPLATE.format(input_text=input_text, target_language=target_language)
+
+def parse_ai_response(response_text):
+    """解析 AI 返回的 JSON 并校验关键字段（格式不完整时抛出 ValueError）"""
+    result = orjson.loads(response_text)
     
-    try:
-        response = model.generate_content(prompt)
-        clean_text = response.text.replace('```json', '').replace('```', '').strip()
-        result = json.loads(clean_text)
+    # 验证关键字段
+    if "structure" not in result or "translation" not in result or "target_sentence" not in result:
+         raise ValueError(f"AI返回格式不完整或缺少关键字段。原始输出: {response_text[:200]}...")
         
-        # 验证关键字段
-        if "structure" not in result or "translation" not in result or "target_sentence" not in result:
-             st.error(f"AI返回格式不完整或缺少关键字段。原始输出: {response.text[:200]}...")
-             return {"error": "AI返回格式不完整", "structure": []}
-            
+    return result
+
+def handle_ai_error(e):
+    # 捕获 API 错误并显示友好信息
+    if "429" in str(e):
+         st.error("AI服务配额已超限 (429)。请等待配额刷新或升级你的 API 计划。")
+    else:
+         st.error(f"AI分析失败: {e}")
+    return {"error": f"AI分析失败: {e}", "structure": []}
+
+# Gemini 偶发的限流 (429) 和服务不可用 (503) 用带随机抖动的指数退避重试，其它错误直接抛出
+gemini_retry = retry(
+    retry=retry_if_exception_type((google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)),
+    wait=wait_random_exponential(multiplier=0.5, max=8),
+    stop=stop_after_attempt(3),
+    reraise=True
+)
+
+@gemini_retry
+def stream_analysis(prompt, on_chunk=None):
+    """流式接收模型输出，边生成边回调展示进度，返回完整文本（重试时从头重新接收）"""
+    response = get_model().generate_content(prompt, stream=True)
+    buffer = []
+    for chunk in response:
+        buffer.append(chunk.text)
+        if on_chunk:
+            on_chunk("".join(buffer))
+    return "".join(buffer)
+
+@gemini_retry
+def generate_analysis(model, prompt):
+    """非流式调用，返回完整文本（批量模式在线程池中执行）"""
+    return model.generate_content(prompt).text
+
+AI_RESULT_CACHE_SIZE = 1000 # 进程内保留的解析结果条数上限（最近最少使用的先淘汰）
+# 提示词/输出结构的版本号，作为缓存键的一部分：修改 SYSTEM_INSTRUCTION、PROMPT_TEMPLATE、
+# ANALYSIS_SCHEMA 或模型后，旧的解析结果不会再被命中
+ANALYSIS_VERSION = hashlib.sha1(
+    orjson.dumps([GEMINI_MODEL_NAME, SYSTEM_INSTRUCTION, PROMPT_TEMPLATE, ANALYSIS_SCHEMA])
+).hexdigest()[:12]
+
+# 解析结果由我们自己按 (版本, 句子, 目标语言) 保存，不用 st.cache_data：
+# 流式展示的回调会写入页面元素，放进 st.cache_data 会在命中时回放到已不存在的容器上
+@st.cache_resource
+def get_analysis_cache():
+    return {"lock": threading.Lock(), "results": OrderedDict()}
+
+def get_cached_analysis(key):
+    cache = get_analysis_cache()
+    with cache["lock"]:
+        result = cache["results"].get(key)
+        if result is not None:
+            cache["results"].move_to_end(key)
         return result
-        
+
+def store_analysis(key, result):
+    """只保存成功解析的结果，出错的请求下次会重新调用 Gemini"""
+    cache = get_analysis_cache()
+    with cache["lock"]:
+        cache["results"][key] = result
+        cache["results"].move_to_end(key)
+        while len(cache["results"]) > AI_RESULT_CACHE_SIZE:
+            cache["results"].popitem(last=False)
+
+def analysis_key(input_text, target_language):
+    return (ANALYSIS_VERSION, input_text.strip(), target_language)
+
+def _analyze_once(input_text, target_language, fetch):
+    """单句与批量共用的分析流程：查缓存 → fetch(prompt) 取得模型输出 → 解析 → 写入缓存；出错时返回错误结果"""
+    key = analysis_key(input_text, target_language)
+    cached = get_cached_analysis(key)
+    if cached is not None:
+        return cached
+    try:
+        # 全部接收完成后再统一解析 JSON
+        result = parse_ai_response(fetch(build_prompt(key[1], target_language)))
     except Exception as e:
-        # 捕获 API 错误并显示友好信息
-        if "429" in str(e):
-             st.error("AI服务配额已超限 (429)。请等待配额刷新或升级你的 API 计划。")
-        else:
-             st.error(f"AI分析失败: {e}")
-        return {"error": f"AI分析失败: {e}", "structure": []}
+        return handle_ai_error(e)
+    store_analysis(key, result)
+    return result
+
+def analyze_with_ai(input_text, target_language, on_chunk=None):
+    """单句分析（同步）；on_chunk 接收已生成的部分文本，用于实时展示"""
+    return _analyze_once(input_text, target_language, lambda prompt: stream_analysis(prompt, on_chunk))
+
+def generate_analysis_or_error(model, prompt):
+    """在线程池中执行：异常作为返回值带回主线程，不在工作线程里调用任何 st.* 接口"""
+    try:
+        return generate_analysis(model, prompt)
+    except Exception as e:
+        return e
+
+def raise_or_return(response):
+    if isinstance(response, Exception):
+        raise response
+    return response
+
+def analyze_batch(texts, target_language):
+    """批量分析：在线程池中并发请求 Gemini（线程数即并发上限），按输入顺序返回结果"""
+    model = get_model()
+    # 同一批次中重复的句子只请求一次，缓存已命中的句子不再请求
+    unique_texts = list(dict.fromkeys(t.strip() for t in texts))
+    pending_texts = [t for t in unique_texts if get_cached_analysis(analysis_key(t, target_language)) is None]
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+        responses = dict(zip(pending_texts, executor.map(
+            lambda t: generate_analysis_or_error(model, build_prompt(t, target_language)), pending_texts
+        )))
+    # 解析、缓存和错误提示回到主线程，与单句模式共用 _analyze_once
+    result_by_text = {
+        t: _analyze_once(t, target_language, lambda prompt, t=t: raise_or_return(responses[t]))
+        for t in unique_texts
+    }
+    return [result_by_text[t.strip()] for t in texts]
 
 # --- 3. 页面配置 ---
 st.set_page_config(
@@ -272,7 +723,8 @@ st.set_page_config(
     initial_sidebar_state="expanded" 
 )
 
-# 样式代码（保持不变）
+# 样式代码：Streamlit 每次重跑后会移除未重新输出的元素，因此样式需每次注入；
+# 页面背景色已移至 .streamlit/config.toml 的主题配置中
 st.markdown("""
 <style>
     #MainMenu {visibility: hidden;}
@@ -280,7 +732,6 @@ st.markdown("""
     
     td { white-space: normal !important; word-wrap: break-word !important; }
     
-    .stApp { background-color: #fafafa; }
     .main .block-container { 
         background-color: #ffffff; 
         padding: 2rem; 
@@ -334,9 +785,11 @@ with st.sidebar:
     
     hist_df_stats = load_history()
     if not hist_df_stats.empty:
+        # 一次 value_counts 同时得到语言种类数和最常用语言
+        lang_counts = hist_df_stats['language'].value_counts()
         total_queries = len(hist_df_stats)
-        langs_learned = hist_df_stats['language'].nunique()
-        top_lang = hist_df_stats['language'].mode()[0] if not hist_df_stats.empty else "无"
+        langs_learned = len(lang_counts)
+        top_lang = lang_counts.index[0] if not lang_counts.empty else "无"
         
         c1, c2 = st.columns(2)
         c1.metric("总查询", total_queries)
@@ -345,6 +798,8 @@ with st.sidebar:
     else:
         st.info("暂无学习数据")
         
+    st.button("🔄 重新同步云端数据", on_click=reset_history_snapshot, use_container_width=True)
+        
     st.markdown("---")
     st.markdown("💡 *Made with Streamlit & Gemini*")
 
@@ -361,7 +816,9 @@ with st.container():
         index=0 
     )
 
-    sentence = st.text_area("", height=100, placeholder="在此输入你的句子（例如：中文、韩语、或任何你想分析的语言）...")
+    batch_mode = st.checkbox("📋 批量模式（每行一句）", key='batch_mode')
+    input_placeholder = "每行输入一个句子，AI 会并发解析所有句子..." if batch_mode else "在此输入你的句子（例如：中文、韩语、或任何你想分析的语言）..."
+    sentence = st.text_area("", height=100, placeholder=input_placeholder)
     
     col_btn, col_empty = st.columns([1, 3])
     with col_btn:
@@ -370,18 +827,67 @@ with st.container():
     if analyze_btn:
         if not sentence:
             st.toast("⚠️ 请先输入句子！", icon="✍️")
+        elif batch_mode:
+            # 同一批次中重复的句子只解析、保存和展示一次，避免写入多条相同记录
+            lines = list(dict.fromkeys(line.strip() for line in sentence.splitlines() if line.strip()))
+            history_df = load_history()
+            history_hits = [find_history_analysis(history_df, line, target_lang_choice) for line in lines]
+            pending_lines = [line for line, hit in zip(lines, history_hits) if hit is None]
+
+            fresh_results = []
+            if pending_lines:
+                with st.spinner(f'🤖 AI 正在并发解析 {len(pending_lines)} 个句子...'):
+                    fresh_results = analyze_batch(pending_lines, target_lang_choice)
+            fresh_iter = iter(fresh_results)
+
+            saved_count = 0
+            for line, hit in zip(lines, history_hits):
+                ai_result = hit if hit is not None else next(fresh_iter)
+                if "error" in ai_result:
+                    continue
+                if hit is None:
+                    save_record(line, ai_result)
+                    saved_count += 1
+
+                lang_name = ai_result.get('language', '未知')
+                target_sentence = ai_result.get('target_sentence', line)
+                with st.expander(f"[{lang_name}] {target_sentence}"):
+                    st.caption(f"📝 原始输入: {line}")
+                    st.markdown(f"**翻译：** {ai_result.get('translation', '')}")
+                    correction = ai_result.get('correction', target_sentence)
+                    if correction != target_sentence:
+                        st.info(f"💡 **修正版本:** {correction}")
+                    render_structure_table(ai_result.get('structure', []))
+
+            if saved_count:
+                flush_pending_rows()
+                st.toast(f"✅ 批量解析完成 {saved_count}/{len(lines)} 条！正在保存到云端。", icon="🎉")
+            reused_count = len(lines) - len(pending_lines)
+            if reused_count:
+                st.toast(f"⚡ {reused_count} 条句子已从学习足迹中复用解析结果。", icon="♻️")
         else:
             with st.spinner(f'🤖 AI 正在翻译成 {target_lang_choice} 并深度解析...'):
-                ai_result = analyze_with_ai(sentence, target_lang_choice)
+                ai_result = find_history_analysis(load_history(), sentence, target_lang_choice)
+                from_history = ai_result is not None
+                if not from_history:
+                    stream_placeholder = st.empty()
+                    ai_result = analyze_with_ai(
+                        sentence, target_lang_choice,
+                        on_chunk=lambda text: stream_placeholder.code(text[-500:], language="json")
+                    )
+                    stream_placeholder.empty()
                 
                 if "error" in ai_result:
                     pass
+                elif from_history:
+                    st.toast("⚡ 该句子已解析过，已从学习足迹中复用结果。", icon="♻️")
                 else:
                     save_record(sentence, ai_result) 
-                    load_history.clear() 
-                    
-                    st.toast("✅ 解析完成！已保存到云端。", icon="🎉")
+                    flush_pending_rows()
                     
+                    st.toast("✅ 解析完成！正在保存到云端。", icon="🎉")
+                
+                if "error" not in ai_result:
                     # --- 结果展示区 ---
                     st.markdown("###")
                     
@@ -399,9 +905,9 @@ with st.container():
                             st.markdown(f"**🎯 目标句子 ({lang_name}):**")
                             st.markdown(f"<span class='lang-tag'>{target_sentence}</span>", unsafe_allow_html=True)
                         with c_audio:
-                            audio_fp = text_to_speech(target_sentence, lang_name) # 朗读目标句子
-                            if audio_fp:
-                                st.audio(audio_fp.getvalue(), format='audio/mp3')
+                            audio_bytes = text_to_speech(target_sentence, lang_name) # 朗读目标句子
+                            if audio_bytes:
+                                st.audio(audio_bytes, format='audio/mp3')
                             else:
                                 st.warning("🔊 无法生成或播放音频，请检查网络或更换移动浏览器。")
                     
@@ -436,11 +942,7 @@ with st.container():
                         
                     with tab2:
                         st.markdown("#### 逐词拆解")
-                        df = pd.DataFrame(ai_result.get('structure', []))
-                        if not df.empty:
-                            df_display = df.rename(columns=COLUMN_MAPPING)
-                            st.table(df_display)
-                        else:
+                        if not render_structure_table(ai_result.get('structure', [])):
                             st.info("无法生成结构表格")
                             
                     with tab3:
@@ -464,197 +966,210 @@ if 'review_mode' not in st.session_state:
     st.session_state.review_mode = False
 if 'filter_date' not in st.session_state:
     st.session_state.filter_date = None
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 1
 
-# 加载数据
-history_df = load_history()
+# 学习足迹作为独立片段：勾选、筛选、翻页等操作只重跑这一部分，
+# 不会重新执行上方的输入区，已显示的解析结果也会保留
+@st.fragment
+def render_history_section():
+    # 后台保存状态
+    saving_count = check_save_jobs()
+    if saving_count:
+        st.caption(f"☁️ {saving_count} 条新记录正在后台保存到云端，稍后刷新即可在此看到。")
+    unsaved_count = count_record_rows(st.session_state.get('pending_rows', []))
+    if unsaved_count:
+        st.warning(f"⚠️ 有 {unsaved_count} 条记录尚未保存到云端，关闭页面前请重新保存。")
+        st.button("☁️ 重新保存", key="retry_save_btn", on_click=flush_pending_rows)
 
-if not history_df.empty and 'timestamp' in history_df.columns:
+    # 加载数据
+    history_df = load_history()
+
+    if not history_df.empty and 'timestamp' in history_df.columns:
     
-    # 顶部工具栏：日期 + 筛选 + 复习模式 + 导出
-    # 调整列宽：将原 col_date 拆分为 col_date_input 和 col_date_clear
-    col_date_input, col_date_clear, col_filter, col_review, col_export = st.columns([0.20, 0.05, 0.45, 0.15, 0.15])
+        # 顶部工具栏：日期 + 筛选 + 复习模式 + 导出
+        # 调整列宽：将原 col_date 拆分为 col_date_input 和 col_date_clear
+        col_date_input, col_date_clear, col_filter, col_review, col_export = st.columns([0.20, 0.05, 0.45, 0.15, 0.15])
     
-    with col_date_input:
-        st.markdown("##### 🔍 选择日期")
-        st.session_state.filter_date = st.date_input(
-            "选择查询日期",
-            value=st.session_state.filter_date,
-            max_value=datetime.now().date(),
-            key='date_selector',
-            label_visibility="collapsed"
-        )
+        with col_date_input:
+            st.markdown("##### 🔍 选择日期")
+            st.session_state.filter_date = st.date_input(
+                "选择查询日期",
+                value=st.session_state.filter_date,
+                max_value=datetime.now().date(),
+                key='date_selector',
+                on_change=reset_history_page,
+                label_visibility="collapsed"
+            )
     
-    # 🌟 新增清除按钮
-    with col_date_clear:
-        st.button("❌", key='clear_date_btn', help="清除日期筛选", on_click=clear_date_filter)
-
-    with col_filter:
-        available_languages = history_df['language'].unique().tolist()
-        if len(available_languages) > 0:
-            st.markdown("##### 语言筛选")
-            cols = st.columns(min(len(available_languages), 5)) 
-            def set_lang_filter(lang):
-                if st.session_state.filter_language == lang:
-                    st.session_state.filter_language = None
-                else:
-                    st.session_state.filter_language = lang
-                st.session_state.select_all = False 
-                st.session_state.delete_selections = {}
-
-            for i, lang in enumerate(available_languages):
-                if i < 5: 
-                    btn_type = "primary" if st.session_state.filter_language == lang else "secondary"
-                    if cols[i].button(lang, key=f"filter_btn_{lang}", type=btn_type):
-                        set_lang_filter(lang)
-                        st.rerun()
-
-    with col_review:
-        st.markdown("##### 复习模式")
-        st.checkbox("开启闪卡", key='review_mode', value=st.session_state.review_mode)
+        # 🌟 新增清除按钮
+        with col_date_clear:
+            st.button("❌", key='clear_date_btn', help="清除日期筛选", on_click=clear_date_filter)
+
+        with col_filter:
+            available_languages = history_df['language'].unique().tolist()
+            if len(available_languages) > 0:
+                st.markdown("##### 语言筛选")
+                cols = st.columns(min(len(available_languages), 5)) 
+                def set_lang_filter(lang):
+                    if st.session_state.filter_language == lang:
+                        st.session_state.filter_language = None
+                    else:
+                        st.session_state.filter_language = lang
+                    st.session_state.select_all = False 
+                    st.session_state.delete_selections = {}
+                    st.session_state.history_page = 1
+
+                for i, lang in enumerate(available_languages):
+                    if i < 5: 
+                        btn_type = "primary" if st.session_state.filter_language == lang else "secondary"
+                        cols[i].button(lang, key=f"filter_btn_{lang}", type=btn_type, on_click=set_lang_filter, args=(lang,))
+
+        with col_review:
+            st.markdown("##### 复习模式")
+            st.checkbox("开启闪卡", key='review_mode', value=st.session_state.review_mode)
     
-    with col_export:
-        st.markdown("##### 导出数据")
-        csv = history_df.to_csv(index=False).encode('utf-8-sig')
-        st.download_button(
-            label="📥 导出 CSV",
-            data=csv,
-            file_name=f'learning_history_{datetime.now().strftime("%Y%m%d")}.csv',
-            mime='text/csv',
-            use_container_width=True
-        )
-
-    # 执行过滤
-    filtered_df = history_df.copy()
+        with col_export:
+            st.markdown("##### 导出数据")
+            csv = build_history_csv(
+                history_df, len(history_df), history_df['timestamp'].iat[-1], get_history_snapshot()["loaded_at"]
+            )
+            st.download_button(
+                label="📥 导出 CSV",
+                data=csv,
+                file_name=f'learning_history_{datetime.now().strftime("%Y%m%d")}.csv',
+                mime='text/csv',
+                use_container_width=True
+            )
+
+        search_query = st.text_input("🔍 搜索历史:", placeholder="搜索原文、翻译或笔记...", key='search_query', on_change=reset_history_page)
     
-    # 语言过滤
-    if st.session_state.filter_language:
-        filtered_df = filtered_df[filtered_df['language'] == st.session_state.filter_language]
-
-    # 日期过滤逻辑
-    if st.session_state.filter_date:
-        if 'timestamp' in filtered_df.columns:
-            # 确保时间戳是日期对象
-            filtered_df['record_date'] = pd.to_datetime(filtered_df['timestamp']).dt.date
-            selected_date = st.session_state.filter_date
-            filtered_df = filtered_df[filtered_df['record_date'] == selected_date]
-        if 'record_date' in filtered_df.columns:
-            filtered_df = filtered_df.drop(columns=['record_date'])
-            
-    search_query = st.text_input("🔍 搜索历史:", placeholder="搜索原文、翻译或笔记...", key='search_query')
-    if search_query:
-        filtered_df = filtered_df[
-            filtered_df['sentence'].str.contains(search_query, case=False, na=False) | 
-            (filtered_df['data'].astype(str).str.contains(search_query, case=False, na=False))
-        ]
-
-    # 批量删除逻辑 (保持不变)
-    if not filtered_df.empty:
-        c_sel, c_del, c_space = st.columns([0.15, 0.35, 0.5])
-        c_sel.checkbox("全选", key="select_all", on_change=update_selections)
-
-        timestamps_to_delete = [
-            ts for ts, is_checked in st.session_state.delete_selections.items() 
-            if is_checked and ts in filtered_df['timestamp'].values
-        ]
+        # 执行过滤（语言 + 日期 + 关键词），结果供本次渲染和全选回调共用
+        filtered_df = filter_history(history_df, st.session_state.filter_language, st.session_state.filter_date, search_query)
+        # 分页：只渲染最新的若干条记录，避免历史增长后每次重跑都构建全部表格
+        visible_count = HISTORY_PAGE_SIZE * st.session_state.history_page
+        # 当前已显示的时间戳，供全选回调和删除使用
+        page_ts = filtered_df['timestamp'].tail(visible_count).tolist()
+        st.session_state['_page_ts'] = page_ts
+
+        # 批量删除逻辑 (保持不变)
+        if not filtered_df.empty:
+            c_sel, c_del, c_space = st.columns([0.15, 0.35, 0.5])
+            c_sel.checkbox("全选", key="select_all", on_change=update_selections)
+
+            visible_ts = set(page_ts)
+            timestamps_to_delete = [
+                ts for ts, is_checked in st.session_state.delete_selections.items() 
+                if is_checked and ts in visible_ts
+            ]
         
-        c_del.button(
-            "🗑️ 删除选中", 
-            type="primary", 
-            key="bulk_delete_main_btn",
-            on_click=bulk_delete_callback,
-            args=(timestamps_to_delete,)
-        )
-
-    # 列表显示 (保持不变)
-    if filtered_df.empty:
-        st.info("📭 没有找到匹配的记录")
-    else:
-        for index, item in filtered_df.iterrows():
-            timestamp = item['timestamp']
-            lang_label = item.get('language', '未知')
+            c_del.button(
+                f"🗑️ 删除选中 ({len(timestamps_to_delete)})", 
+                type="primary", 
+                key="bulk_delete_main_btn",
+                on_click=bulk_delete_callback,
+                args=(timestamps_to_delete,)
+            )
+
+        # 列表显示 (保持不变)
+        if filtered_df.empty:
+            st.info("📭 没有找到匹配的记录")
+        else:
+            # 倒序遍历普通 dict 列表：最新在前，且不为每行构造 Series
+            page_items = filtered_df.tail(visible_count).to_dict('records')[::-1]
+            if not st.session_state.review_mode:
+                prewarm_speech(page_items)
+            for item in page_items:
+                timestamp = item['timestamp']
+                lang_label = item.get('language', '未知')
             
-            data = item.get('data', {})
-            target_sentence_hist = data.get('target_sentence', item['sentence']) 
-            original_input_hist = item['sentence'] 
+                data = item.get('data', {})
+                target_sentence_hist = data.get('target_sentence', item['sentence']) 
+                original_input_hist = item['sentence'] 
 
-            if st.session_state.review_mode:
-                 display_sentence = target_sentence_hist
-            else:
-                 display_sentence = target_sentence_hist[:30] + '...' if len(target_sentence_hist) > 30 else target_sentence_hist
-                 display_sentence = f"({original_input_hist[:10]}... →) {display_sentence}"
+                if st.session_state.review_mode:
+                     display_sentence = target_sentence_hist
+                else:
+                     display_sentence = target_sentence_hist[:30] + '...' if len(target_sentence_hist) > 30 else target_sentence_hist
+                     display_sentence = f"({original_input_hist[:10]}... →) {display_sentence}"
 
 
-            with st.container():
-                c_check, c_content = st.columns([0.05, 0.95])
+                with st.container():
+                    c_check, c_content = st.columns([0.05, 0.95])
                 
-                with c_check:
-                    checkbox_key = f"sel_{timestamp}"
-                    if checkbox_key not in st.session_state:
-                        st.session_state[checkbox_key] = st.session_state.delete_selections.get(timestamp, False)
-                    st.checkbox("", key=checkbox_key, on_change=update_individual_selection, args=(timestamp,), label_visibility="hidden")
+                    with c_check:
+                        checkbox_key = f"sel_{timestamp}"
+                        if checkbox_key not in st.session_state:
+                            st.session_state[checkbox_key] = st.session_state.delete_selections.get(timestamp, False)
+                        st.checkbox("", key=checkbox_key, on_change=update_individual_selection, args=(timestamp,), label_visibility="hidden")
                 
-                with c_content:
-                    expander_label = f"[{lang_label}] {display_sentence}"
+                    with c_content:
+                        expander_label = f"[{lang_label}] {display_sentence}"
                     
-                    if st.session_state.review_mode:
-                        # 复习模式
-                        with st.expander(expander_label):
-                            reveal_key = f'reveal_{timestamp}'
-                            if reveal_key not in st.session_state:
-                                st.session_state[reveal_key] = False
+                        if st.session_state.review_mode:
+                            # 复习模式
+                            with st.expander(expander_label):
+                                reveal_key = f'reveal_{timestamp}'
+                                if reveal_key not in st.session_state:
+                                    st.session_state[reveal_key] = False
                                 
-                            if st.session_state[reveal_key]:
-                                st.button("隐藏答案", key=f'hide_btn_{timestamp}', on_click=lambda: st.session_state.update({reveal_key: False}))
-                                show_answer = True
-                            else:
-                                st.button("显示答案", key=f'show_btn_{timestamp}', type="primary", on_click=lambda: st.session_state.update({reveal_key: True}))
-                                show_answer = False
+                                if st.session_state[reveal_key]:
+                                    st.button("隐藏答案", key=f'hide_btn_{timestamp}', on_click=lambda: st.session_state.update({reveal_key: False}))
+                                    show_answer = True
+                                else:
+                                    st.button("显示答案", key=f'show_btn_{timestamp}', type="primary", on_click=lambda: st.session_state.update({reveal_key: True}))
+                                    show_answer = False
                             
-                            st.markdown("---")
+                                st.markdown("---")
                             
-                            if show_answer:
-                                st.caption(f"📝 原始输入: {original_input_hist} | 🕒 {timestamp}")
+                                if show_answer:
+                                    st.caption(f"📝 原始输入: {original_input_hist} | 🕒 {timestamp}")
+                                    if data and "structure" in data:
+                                        st.markdown(f"**翻译：** {data.get('translation', '')}")
+                                        st.info(f"💡 **修正版本:** {data.get('correction', target_sentence_hist)}")
+                                        h_tab1, h_tab2 = st.tabs(["结构表", "笔记"])
+                                        with h_tab1:
+                                            render_structure_table(data['structure'])
+                                        with h_tab2:
+                                            st.info(data.get('nuances', '无笔记'))
+                                    else:
+                                        st.warning("数据无法解析")
+                        else:
+                            # 正常模式
+                            with st.expander(expander_label):
+                                st.caption(f"📝 原始输入: {original_input_hist} | 🕒 {timestamp} | 👤 {item['user']}")
+                                data = item.get('data', {})
                                 if data and "structure" in data:
+                                    if st.button("🔊 朗读", key=f"tts_{timestamp}"):
+                                        audio_bytes = text_to_speech(target_sentence_hist, lang_label)
+                                        if audio_bytes:
+                                            st.audio(audio_bytes, format='audio/mp3')
+                                        else:
+                                            st.toast("🔊 移动端播放失败。", icon="⚠️")
+
                                     st.markdown(f"**翻译：** {data.get('translation', '')}")
-                                    st.info(f"💡 **修正版本:** {data.get('correction', target_sentence_hist)}")
+                                
+                                    correction_hist = data.get('correction', target_sentence_hist)
+                                    if correction_hist != target_sentence_hist:
+                                        st.info(f"💡 **修正版本:** {correction_hist}")
+
                                     h_tab1, h_tab2 = st.tabs(["结构表", "笔记"])
                                     with h_tab1:
-                                        h_df = pd.DataFrame(data['structure'])
-                                        st.table(h_df.rename(columns=COLUMN_MAPPING))
+                                        render_structure_table(data['structure'])
                                     with h_tab2:
                                         st.info(data.get('nuances', '无笔记'))
                                 else:
                                     st.warning("数据无法解析")
-                    else:
-                        # 正常模式
-                        with st.expander(expander_label):
-                            st.caption(f"📝 原始输入: {original_input_hist} | 🕒 {timestamp} | 👤 {item['user']}")
-                            data = item.get('data', {})
-                            if data and "structure" in data:
-                                if st.button("🔊 朗读", key=f"tts_{timestamp}"):
-                                    audio_bytes = text_to_speech(target_sentence_hist, lang_label)
-                                    if audio_bytes:
-                                        st.audio(audio_bytes.getvalue(), format='audio/mp3')
-                                    else:
-                                        st.toast("🔊 移动端播放失败。", icon="⚠️")
-
-                                st.markdown(f"**翻译：** {data.get('translation', '')}")
-                                
-                                correction_hist = data.get('correction', target_sentence_hist)
-                                if correction_hist != target_sentence_hist:
-                                    st.info(f"💡 **修正版本:** {correction_hist}")
-
-                                h_tab1, h_tab2 = st.tabs(["结构表", "笔记"])
-                                with h_tab1:
-                                    h_df = pd.DataFrame(data['structure'])
-                                    st.table(h_df.rename(columns=COLUMN_MAPPING))
-                                with h_tab2:
-                                    st.info(data.get('nuances', '无笔记'))
-                            else:
-                                st.warning("数据无法解析")
-
-else:
-    st.info("🌟 欢迎使用！输入第一个句子开始你的语言之旅吧！")
 
+            if len(filtered_df) > visible_count:
+                st.button(
+                    f"加载更多 (剩余 {len(filtered_df) - visible_count} 条)",
+                    key="load_more_history_btn",
+                    on_click=load_more_history,
+                    use_container_width=True
+                )
 
+    else:
+        st.info("🌟 欢迎使用！输入第一个句子开始你的语言之旅吧！")
 
+render_history_section()